@@ -1,14 +1,122 @@
 """Scaffolding to host your LangChain Chatbot on Steamship and connect it to Telegram."""
+import json
 import logging
-from typing import Type
+import queue
+import threading
+from functools import partial
+from typing import Callable, List, Type
 
 import requests
 from pydantic import Field
+from requests.adapters import HTTPAdapter
 from steamship.invocable import PackageService, post, Config
+from urllib3.util.retry import Retry
 
 from babyagi import solve_agi_problem
 from response_cache import already_responded, record_response
 
+TELEGRAM_TIMEOUT_SECONDS = 5
+# Telegram rejects messages over 4096 characters, counted in UTF-16 code units;
+# all message lengths here are measured the same way.
+TELEGRAM_MAX_MESSAGE_CHARS = 3500
+
+# Shared across invocations so Telegram calls reuse pooled keep-alive connections
+# instead of paying a TCP + TLS handshake on every request.
+telegram_session = requests.Session()
+telegram_session.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=32,
+        max_retries=Retry(total=3, backoff_factor=0.3),
+    ),
+)
+
+
+def telegram_length(text: str) -> int:
+    """Length of text as Telegram counts it, in UTF-16 code units."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def split_message(text: str, max_chars: int = TELEGRAM_MAX_MESSAGE_CHARS) -> List[str]:
+    """Split text into chunks Telegram accepts, preferring to break on newlines."""
+    chunks = []
+    while telegram_length(text) > max_chars:
+        # Number of leading code points that fit; astral characters take two units
+        units, limit = 0, 0
+        for limit, char in enumerate(text):
+            units += 2 if ord(char) > 0xFFFF else 1
+            if units > max_chars:
+                break
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            # Always make progress, even if a single character is over the limit
+            cut = max(limit, 1)
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    chunks.append(text)
+    # Telegram rejects whitespace-only text as an empty message
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
+
+
+class TelegramOutbox:
+    """Send messages in order from a background thread.
+
+    Messages queued while a send is in flight are coalesced into the next send, so
+    bursts of agent output cost fewer Telegram calls without holding any of it back.
+    """
+
+    _CLOSED = object()
+
+    def __init__(
+        self,
+        send: Callable[[str], None],
+        max_chars: int = TELEGRAM_MAX_MESSAGE_CHARS,
+    ):
+        self.send = send
+        self.max_chars = max_chars
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+
+    def __enter__(self) -> "TelegramOutbox":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._queue.put(self._CLOSED)
+        self._thread.join()
+
+    def put(self, text: str) -> None:
+        for chunk in split_message(text, self.max_chars):
+            self._queue.put(chunk)
+
+    def _drain(self) -> None:
+        carry = None
+        while True:
+            text = self._queue.get() if carry is None else carry
+            carry = None
+            if text is self._CLOSED:
+                return
+            length = telegram_length(text)
+            while True:
+                try:
+                    waiting = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if waiting is self._CLOSED:
+                    carry = waiting
+                    break
+                waiting_length = telegram_length(waiting)
+                if length + 1 + waiting_length > self.max_chars:
+                    carry = waiting
+                    break
+                text += "\n" + waiting
+                length += 1 + waiting_length
+            try:
+                self.send(text)
+            except Exception as e:
+                logging.error(f"Failed to send Telegram message: {e}")
+
 
 class TelegramBuddyConfig(Config):
     """Config object containing required parameters to initialize a MyPackage instance."""
@@ -46,40 +154,40 @@ class LangChainTelegramChatbot(PackageService):
         """Return the Configuration class."""
         return TelegramBuddyConfig
 
+    def _telegram_api(self, method: str, **data) -> requests.Response:
+        return telegram_session.post(
+            f"https://api.telegram.org/bot{self.config.bot_token}/{method}",
+            data=data,
+            timeout=TELEGRAM_TIMEOUT_SECONDS,
+        )
+
     def instance_init(self) -> None:
         """Connect the instance to telegram."""
         # Unlink the previous instance
-        requests.get(
-            f"https://api.telegram.org/bot{self.config.bot_token}/deleteWebhook"
-        )
+        self._telegram_api("deleteWebhook")
         # Reset the bot
-        requests.get(f"https://api.telegram.org/bot{self.config.bot_token}/getUpdates")
+        self._telegram_api("getUpdates")
         # Connect the new instance
-        requests.get(
-            f"https://api.telegram.org/bot{self.config.bot_token}/setWebhook",
-            params={
-                "url": f"{self.context.invocable_url}respond",
-                "allowed_updates": ["message"],
-            },
+        self._telegram_api(
+            "setWebhook",
+            url=f"{self.context.invocable_url}respond",
+            allowed_updates=json.dumps(["message"]),
         )
 
     @post("info")
     def info(self) -> dict:
         """Endpoint returning information about this bot."""
-        resp = requests.get(
-            f"https://api.telegram.org/bot{self.config.bot_token}/getMe"
-        ).json()
+        resp = self._telegram_api("getMe").json()
         logging.info(f"/info: {resp}")
         return {"telegram": resp.get("result")}
 
     def _send_message(self, chat_id: str, message_text: str) -> None:
-        requests.get(
-            f"https://api.telegram.org/bot{self.config.bot_token}/sendMessage",
-            params={
-                "chat_id": chat_id,
-                "text": message_text,
-            },
-        )
+        resp = self._telegram_api("sendMessage", chat_id=chat_id, text=message_text)
+        # Raise on rejected messages (e.g. 400 bad text, 429 rate limited) so the
+        # outbox logs them instead of dropping them silently
+        resp.raise_for_status()
+        if not resp.json().get("ok"):
+            raise RuntimeError(f"Telegram rejected the message: {resp.text}")
 
     @post("respond", public=True)
     def respond(self, update_id: int, message: dict) -> str:
@@ -88,38 +196,35 @@ class LangChainTelegramChatbot(PackageService):
         chat_id = message["chat"]["id"]
         message_id = message["message_id"]
 
-        try:
-            if already_responded(self.client, chat_id, message_id):
-                logging.info(f"Skip message {chat_id} {message_id}")
-                return "ok"
-
-            record_response(self.client, chat_id, message_id)
-
-            if message_text.startswith("/"):
-                self._send_message(chat_id, "Hey!")
-                self._send_message(
-                    chat_id, "Type an objective that you want me to solve."
+        # The agent keeps producing while the outbox talks to Telegram
+        with TelegramOutbox(partial(self._send_message, chat_id)) as outbox:
+            try:
+                if already_responded(self.client, chat_id, message_id):
+                    logging.info(f"Skip message {chat_id} {message_id}")
+                    return "ok"
+
+                record_response(self.client, chat_id, message_id)
+
+                if message_text.startswith("/"):
+                    outbox.put("Hey!")
+                    outbox.put("Type an objective that you want me to solve.")
+                    return "ok"
+
+                outbox.put(f"Hey! I'm going to solve the objective {message_text}")
+
+                for message in solve_agi_problem(
+                    client=self.client,
+                    objective=message_text,
+                    model_name=self.config.model_name,
+                    max_tokens=self.config.max_tokens,
+                    max_iterations=self.config.max_iterations,
+                ):
+                    outbox.put(message)
+
+            except Exception as e:
+                outbox.put(
+                    f"I'm sorry something went wrong, "
+                    f"here's the exception I received: {e}"
                 )
-                return "ok"
-
-            self._send_message(
-                chat_id, f"Hey! I'm going to solve the objective {message_text}"
-            )
-
-            for message in solve_agi_problem(
-                client=self.client,
-                objective=message_text,
-                model_name=self.config.model_name,
-                max_tokens=self.config.max_tokens,
-                max_iterations=self.config.max_iterations,
-            ):
-                self._send_message(chat_id, message)
-
-        except Exception as e:
-            self._send_message(
-                chat_id,
-                f"I'm sorry something went wrong, "
-                f"here's the exception I received: {e}",
-            )
 
         return "ok"
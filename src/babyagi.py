@@ -1,7 +1,14 @@
+import hashlib
+import os
+import tempfile
+import uuid
 from collections import deque
-from typing import Dict, Any, List, Optional
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, Any, Iterable, List, Optional, Tuple
 
+import langchain
 from langchain import LLMChain
+from langchain.cache import SQLiteCache
 from langchain.agents import AgentExecutor, ZeroShotAgent
 from langchain.chains.base import Chain
 from langchain.llms import BaseLLM
@@ -12,8 +19,23 @@ from steamship_langchain.llms import OpenAIChat
 from steamship_langchain.vectorstores import SteamshipVectorStore
 
 from chains import TaskCreationChain, TaskPrioritizationChain
+from prompt_cache import SemanticPromptCache
 from prompts import get_prompt, get_tools
 
+LLM_CACHE_PATH = os.path.join(tempfile.gettempdir(), "babyagi_llm_cache.db")
+# Task creation and prioritization only return short lists
+PLANNER_MAX_TOKENS = 256
+
+# Runs vectorstore calls while the agent waits on its planning LLM calls
+background = ThreadPoolExecutor(max_workers=4)
+
+# None of the chains depend on the objective, so they are shared per
+# (workspace handle, model name, max tokens). This is the cache solve_agi_problem
+# relies on; the tool and prompt caches in prompts.py only pay off for callers that
+# assemble their own agent through BabyAGI.from_llm. Entries are never refreshed and
+# keep the Steamship client of the invocation that built them.
+_chains_cache = {}
+
 
 def get_next_task(
     task_creation_chain: LLMChain,
@@ -21,15 +43,30 @@ def get_next_task(
     task_description: str,
     task_list: List[str],
     objective: str,
+    prompt_cache: Optional[SemanticPromptCache] = None,
 ) -> List[Dict]:
     """Get the next task."""
-    incomplete_tasks = ", ".join(task_list)
-    response = task_creation_chain.run(
+    inputs = dict(
         result=result,
         task_description=task_description,
-        incomplete_tasks=incomplete_tasks,
+        incomplete_tasks=", ".join(task_list),
         objective=objective,
     )
+    if prompt_cache is None:
+        response = task_creation_chain.run(**inputs)
+    else:
+        # Only the free-text result may differ from a cached call
+        response = prompt_cache.run(
+            task_creation_chain,
+            query=result,
+            key={
+                "chain": "task_creation",
+                "objective": objective,
+                "task_description": task_description,
+                "incomplete_tasks": sorted(task_list),
+            },
+            **inputs,
+        )
     new_tasks = response.split("\n")
     return [{"task_name": task_name} for task_name in new_tasks if task_name.strip()]
 
@@ -37,7 +74,7 @@ def get_next_task(
 def prioritize_tasks(
     task_prioritization_chain: LLMChain,
     this_task_id: int,
-    task_list: List[Dict],
+    task_list: Iterable[Dict],
     objective: str,
 ) -> List[Dict]:
     """Prioritize tasks."""
@@ -61,21 +98,52 @@ def prioritize_tasks(
 
 def _get_top_tasks(vectorstore, query: str, k: int) -> List[str]:
     """Get the top k tasks based on the query."""
+    # Results already come back ordered from most to least similar
     results = vectorstore.similarity_search_with_score(query, k=k)
-    if not results:
-        return []
-    sorted_results, _ = zip(*sorted(results, key=lambda x: x[1], reverse=True))
-    return [str(item.metadata["task"]) for item in sorted_results]
+    return [str(doc.metadata["task"]) for doc, _ in results]
 
 
 def execute_task(
-    vectorstore, execution_chain: LLMChain, objective: str, task: str, k: int = 5
+    vectorstore,
+    execution_chain: LLMChain,
+    objective: str,
+    task: str,
+    k: int = 5,
+    context: Optional[List[str]] = None,
 ) -> str:
-    """Execute a task."""
-    context = _get_top_tasks(vectorstore, query=objective, k=k)
+    """Execute a task, searching for its context unless it was prefetched."""
+    if context is None:
+        context = _get_top_tasks(vectorstore, query=objective, k=k)
     return execution_chain.run(objective=objective, context=context, task=task)
 
 
+def build_chains(
+    client: Steamship,
+    llm: BaseLLM,
+    verbose: bool = False,
+    planner_llm: Optional[BaseLLM] = None,
+    **kwargs,
+) -> Tuple[TaskCreationChain, TaskPrioritizationChain, AgentExecutor]:
+    """Build the task creation, task prioritization and execution chains.
+
+    The task creation and prioritization chains use `planner_llm` if given.
+    """
+    tools = get_tools(client, **kwargs)
+    prompt = get_prompt(tools)
+    planner_llm = planner_llm or llm
+    task_creation_chain = TaskCreationChain.from_llm(planner_llm, verbose=verbose)
+    task_prioritization_chain = TaskPrioritizationChain.from_llm(
+        planner_llm, verbose=verbose
+    )
+    llm_chain = LLMChain(llm=llm, prompt=prompt)
+    tool_names = [tool.name for tool in tools]
+    agent = ZeroShotAgent(llm_chain=llm_chain, allowed_tools=tool_names)
+    agent_executor = AgentExecutor.from_agent_and_tools(
+        agent=agent, tools=tools, verbose=True
+    )
+    return task_creation_chain, task_prioritization_chain, agent_executor
+
+
 class BabyAGI(Chain, BaseModel):
     """Controller model for the BabyAGI agent."""
 
@@ -85,7 +153,14 @@ class BabyAGI(Chain, BaseModel):
     execution_chain: AgentExecutor = Field(...)
     task_id_counter: int = Field(1)
     vectorstore: VectorStore = Field(init=False)
+    prompt_cache: Optional[SemanticPromptCache] = None
     max_iterations: Optional[int] = None
+    pending_results: List[Dict] = Field(default_factory=list)
+    # The results index is shared by every run of an objective while task ids restart
+    # at 1, so result ids are prefixed per run to keep earlier runs' results
+    run_id: str = Field(default_factory=lambda: uuid.uuid4().hex)
+    flush_every: int = 5
+    context_size: int = 5
 
     class Config:
         """Configuration for this pydantic object."""
@@ -95,18 +170,53 @@ class BabyAGI(Chain, BaseModel):
     def add_task(self, task: Dict):
         self.task_list.append(task)
 
+    def store_result(
+        self, task: Dict, result: str, objective: str, k: int, prefetch: bool = True
+    ) -> Optional[List[str]]:
+        """Buffer a task result and, if `prefetch`, return the next task's context."""
+        self.pending_results.append(
+            {
+                "text": result,
+                "task": task["task_name"],
+                "id": f"result_{self.run_id}_{task['task_id']}",
+            }
+        )
+        if len(self.pending_results) >= self.flush_every:
+            self.flush_results()
+        if not prefetch:
+            return None
+        # Buffered results are not searchable yet, they lead as the most recent ones
+        pending = [r["task"] for r in reversed(self.pending_results)]
+        return (pending + _get_top_tasks(self.vectorstore, query=objective, k=k))[:k]
+
+    def flush_results(self):
+        """Write the buffered results to the VectorStore in a single call."""
+        if not self.pending_results:
+            return
+        self.vectorstore.add_texts(
+            texts=[r["text"] for r in self.pending_results],
+            metadatas=[{"task": r["task"]} for r in self.pending_results],
+            ids=[r["id"] for r in self.pending_results],
+        )
+        self.pending_results.clear()
+
+    # Each section is yielded as a single message so it costs one Telegram call.
     def print_task_list(self):
-        yield "\n*****TASK LIST*****\n"
-        for t in self.task_list:
-            yield str(t["task_id"]) + ": " + t["task_name"]
+        yield "\n".join(
+            ["\n*****TASK LIST*****\n"]
+            + [str(t["task_id"]) + ": " + t["task_name"] for t in self.task_list]
+        )
 
     def print_next_task(self, task: Dict):
-        yield "\n*****NEXT TASK*****\n"
-        yield str(task["task_id"]) + ": " + task["task_name"]
+        yield (
+            "\n*****NEXT TASK*****\n\n"
+            + str(task["task_id"])
+            + ": "
+            + task["task_name"]
+        )
 
     def print_task_result(self, result: str):
-        yield "\n*****TASK RESULT*****\n"
-        yield result
+        yield "\n*****TASK RESULT*****\n\n" + result
 
     @property
     def input_keys(self) -> List[str]:
@@ -122,53 +232,77 @@ class BabyAGI(Chain, BaseModel):
         first_task = inputs.get("first_task", "Make a todo list")
         self.add_task({"task_id": 1, "task_name": first_task})
         num_iters = 0
-        while True:
-            if self.task_list:
-                yield from self.print_task_list()
-
-                # Step 1: Pull the first task
-                task = self.task_list.popleft()
-                yield from self.print_next_task(task)
-
-                # Step 2: Execute the task
-                result = execute_task(
-                    self.vectorstore, self.execution_chain, objective, task["task_name"]
-                )
-                this_task_id = int(task["task_id"])
-                yield from self.print_task_result(result)
-
-                # Step 3: Store the result in the VectorStore
-                result_id = f"result_{task['task_id']}"
-                self.vectorstore.add_texts(
-                    texts=[result],
-                    metadatas=[{"task": task["task_name"]}],
-                    ids=[result_id],
-                )
-
-                # Step 4: Create new tasks and reprioritize task list
-                new_tasks = get_next_task(
-                    self.task_creation_chain,
-                    result,
-                    task["task_name"],
-                    [t["task_name"] for t in self.task_list],
-                    objective,
-                )
-                for new_task in new_tasks:
-                    self.task_id_counter += 1
-                    new_task.update({"task_id": self.task_id_counter})
-                    self.add_task(new_task)
-                self.task_list = deque(
-                    prioritize_tasks(
+        context = None
+        next_context = None
+        try:
+            while True:
+                if self.task_list:
+                    yield from self.print_task_list()
+
+                    # Step 1: Pull the first task
+                    task = self.task_list.popleft()
+                    yield from self.print_next_task(task)
+
+                    # Step 2: Execute the task
+                    result = execute_task(
+                        self.vectorstore,
+                        self.execution_chain,
+                        objective,
+                        task["task_name"],
+                        k=self.context_size,
+                        context=context,
+                    )
+                    this_task_id = int(task["task_id"])
+                    yield from self.print_task_result(result)
+
+                    # Step 3: Store the result in the VectorStore and prefetch the next
+                    # task's context, overlapping with step 4. The last iteration has
+                    # no next task to prefetch for.
+                    last_iteration = (
+                        self.max_iterations is not None
+                        and num_iters + 1 == self.max_iterations
+                    )
+                    next_context = background.submit(
+                        self.store_result,
+                        task,
+                        result,
+                        objective,
+                        self.context_size,
+                        prefetch=not last_iteration,
+                    )
+
+                    # Step 4: Create new tasks and reprioritize task list.
+                    # Prioritization has to see the new tasks, so these stay sequential.
+                    new_tasks = get_next_task(
+                        self.task_creation_chain,
+                        result,
+                        task["task_name"],
+                        [t["task_name"] for t in self.task_list],
+                        objective,
+                        self.prompt_cache,
+                    )
+                    for new_task in new_tasks:
+                        self.task_id_counter += 1
+                        new_task.update({"task_id": self.task_id_counter})
+                        self.add_task(new_task)
+                    prioritized = prioritize_tasks(
                         self.task_prioritization_chain,
                         this_task_id,
-                        list(self.task_list),
+                        self.task_list,
                         objective,
                     )
-                )
-            num_iters += 1
-            if self.max_iterations is not None and num_iters == self.max_iterations:
-                yield "\n*****TASK ENDING*****\n"
-                break
+                    self.task_list.clear()
+                    self.task_list.extend(prioritized)
+                    context = next_context.result()
+                num_iters += 1
+                if self.max_iterations is not None and num_iters == self.max_iterations:
+                    yield "\n*****TASK ENDING*****\n"
+                    break
+        finally:
+            # Do not lose results still buffered when the run ends or is interrupted
+            if next_context is not None:
+                wait([next_context])
+            self.flush_results()
 
     @classmethod
     def from_llm(
@@ -177,26 +311,22 @@ class BabyAGI(Chain, BaseModel):
         llm: BaseLLM,
         vectorstore: VectorStore,
         verbose: bool = False,
+        prompt_cache: Optional[SemanticPromptCache] = None,
+        planner_llm: Optional[BaseLLM] = None,
         **kwargs,
     ) -> "BabyAGI":
         """Initialize the BabyAGI Controller."""
-        tools = get_tools(client, **kwargs)
-        prompt = get_prompt(tools)
-        task_creation_chain = TaskCreationChain.from_llm(llm, verbose=verbose)
-        task_prioritization_chain = TaskPrioritizationChain.from_llm(
-            llm, verbose=verbose
-        )
-        llm_chain = LLMChain(llm=llm, prompt=prompt)
-        tool_names = [tool.name for tool in tools]
-        agent = ZeroShotAgent(llm_chain=llm_chain, allowed_tools=tool_names)
-        agent_executor = AgentExecutor.from_agent_and_tools(
-            agent=agent, tools=tools, verbose=True
-        )
+        (
+            task_creation_chain,
+            task_prioritization_chain,
+            agent_executor,
+        ) = build_chains(client, llm, verbose, planner_llm, **kwargs)
         return cls(
             task_creation_chain=task_creation_chain,
             task_prioritization_chain=task_prioritization_chain,
             execution_chain=agent_executor,
             vectorstore=vectorstore,
+            prompt_cache=prompt_cache,
             **kwargs,
         )
 
@@ -208,27 +338,61 @@ def solve_agi_problem(
     max_tokens: int,
     max_iterations: Optional[int] = None,
 ):
-    llm = OpenAIChat(
-        client=client, temperature=0, model_name=model_name, max_tokens=max_tokens
-    )
+    # Serve repeated prompts (same prompt, model and params) without calling OpenAI
+    if langchain.llm_cache is None:
+        langchain.llm_cache = SQLiteCache(database_path=LLM_CACHE_PATH)
+
+    # Logging of LLMChains
+    verbose = True
+    chains_key = (client.config.workspace_handle, model_name, max_tokens)
+    if chains_key not in _chains_cache:
+        llm = OpenAIChat(
+            client=client, temperature=0, model_name=model_name, max_tokens=max_tokens
+        )
+        planner_llm = OpenAIChat(
+            client=client,
+            temperature=0,
+            model_name=model_name,
+            max_tokens=min(max_tokens, PLANNER_MAX_TOKENS),
+        )
+        _chains_cache[chains_key] = build_chains(
+            client,
+            llm,
+            verbose,
+            planner_llm,
+            model_name=model_name,
+            max_tokens=max_tokens,
+        )
+    task_creation_chain, task_prioritization_chain, agent_executor = _chains_cache[
+        chains_key
+    ]
+
+    # hash() is salted per interpreter, use a stable digest so results are reused
+    objective_key = hashlib.sha256(objective.encode()).hexdigest()[:16]
     vectorstore = SteamshipVectorStore(
         client=client,
-        index_name=f"{client.config.workspace_handle}_index_{hash(objective)}",
+        index_name=f"{client.config.workspace_handle}_index_{objective_key}",
         embedding="text-embedding-ada-002",
     )
+    # Kept apart from the results index, which is scoped to a single objective
+    prompt_cache = SemanticPromptCache(
+        vectorstore=SteamshipVectorStore(
+            client=client,
+            index_name=f"{client.config.workspace_handle}_prompt_cache",
+            embedding="text-embedding-ada-002",
+        ),
+        model_name=model_name,
+    )
 
-    # Logging of LLMChains
-    verbose = True
     # If None, will keep on going forever
     iterations: Optional[int] = max_iterations if max_iterations > 0 else None
-    baby_agi = BabyAGI.from_llm(
-        client=client,
-        llm=llm,
-        model_name=model_name,
+    baby_agi = BabyAGI(
+        task_creation_chain=task_creation_chain,
+        task_prioritization_chain=task_prioritization_chain,
+        execution_chain=agent_executor,
         vectorstore=vectorstore,
-        verbose=verbose,
+        prompt_cache=prompt_cache,
         max_iterations=iterations,
-        max_tokens=max_tokens,
     )
 
     yield from baby_agi._call({"objective": objective})
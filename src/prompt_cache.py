@@ -0,0 +1,63 @@
+import json
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict
+
+from langchain import LLMChain
+from langchain.vectorstores import VectorStore
+
+# Cache entries are only needed by later calls, so they are written off the
+# agent's critical path.
+_writer = ThreadPoolExecutor(max_workers=2)
+
+
+def _log_write_failure(future: Future) -> None:
+    if future.exception() is not None:
+        logging.error(f"Failed to write prompt cache entry: {future.exception()}")
+
+
+class SemanticPromptCache:
+    """Reuse the completion of a previous call with the same structured inputs and
+    near-identical free text."""
+
+    def __init__(
+        self,
+        vectorstore: VectorStore,
+        model_name: str,
+        threshold: float = 0.95,
+        candidates: int = 5,
+    ):
+        self.vectorstore = vectorstore
+        self.model_name = model_name
+        self.threshold = threshold
+        self.candidates = candidates
+
+    def run(self, chain: LLMChain, query: str, key: Dict[str, Any], **inputs) -> str:
+        """Run the chain, or return a cached response.
+
+        A cached response is only reused when its `key` matches exactly and its
+        `query` is at least `threshold` similar to this one.
+        """
+        cache_key = json.dumps({"model_name": self.model_name, **key}, sort_keys=True)
+        try:
+            hits = self.vectorstore.similarity_search_with_score(
+                query, k=self.candidates
+            )
+        except Exception as e:
+            # The cache is best-effort, a failed lookup must not fail the run
+            logging.error(f"Failed to look up prompt cache: {e}")
+            hits = []
+        # Hits come back ordered from most to least similar
+        for doc, score in hits:
+            if score < self.threshold:
+                break
+            if doc.metadata.get("key") == cache_key:
+                return doc.metadata["response"]
+
+        response = chain.run(**inputs)
+        _writer.submit(
+            self.vectorstore.add_texts,
+            texts=[query],
+            metadatas=[{"response": response, "key": cache_key}],
+        ).add_done_callback(_log_write_failure)
+        return response
@@ -3,14 +3,29 @@ from langchain.agents import ZeroShotAgent, Tool
 from steamship_langchain.llms import OpenAIChat
 from steamship_langchain.tools import SteamshipSERP
 
+# Tools keyed by (workspace handle, model name, max tokens); the Steamship client
+# itself is not hashable. solve_agi_problem caches whole chains on the same key, so
+# this only saves work for BabyAGI.from_llm callers. Entries are never refreshed and
+# keep the Steamship client of the invocation that built them.
+_tools_cache = {}
+# Agent prompts keyed by the (name, description) of the tools they describe
+_agent_prompts = {}
+
 
 def get_tools(client, **kwargs):
+    max_tokens = kwargs.get("max_tokens", 256)
+    model_name = kwargs.get("model_name", "gpt-3.5-turbo")
+    key = (client.config.workspace_handle, model_name, max_tokens)
+    if key not in _tools_cache:
+        _tools_cache[key] = _build_tools(client, model_name, max_tokens)
+    return _tools_cache[key]
+
+
+def _build_tools(client, model_name: str, max_tokens: int):
     todo_prompt = PromptTemplate.from_template(
         "You are a planner who is an expert at coming up with a todo list for a given objective. "
         "Come up with a todo list for this objective: {objective}"
     )
-    max_tokens = kwargs.get("max_tokens", 256)
-    model_name = kwargs.get("model_name", "gpt-3.5-turbo")
     todo_chain = LLMChain(
         llm=OpenAIChat(
             client=client, temperature=0, model_name=model_name, max_tokens=max_tokens
@@ -33,6 +48,13 @@ def get_tools(client, **kwargs):
 
 
 def get_prompt(tools):
+    key = tuple((tool.name, tool.description) for tool in tools)
+    if key not in _agent_prompts:
+        _agent_prompts[key] = _build_prompt(tools)
+    return _agent_prompts[key]
+
+
+def _build_prompt(tools):
     prefix = """You are an AI who performs one task based on the following objective: {objective}. Take into account these previously completed tasks: {context}."""
     suffix = """Question: {task}
 {agent_scratchpad}"""
@@ -1,16 +1,123 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Hashable, Optional
+
 from steamship import Tag, Steamship, File
 
 
-def already_responded(client: Steamship, chat_id: str, message_id: str) -> bool:
-    return (
-        len(
-            Tag.query(
-                client,
-                tag_filter_query=f'kind "chat_message_id" and name "{chat_id}_{message_id}"',
+class _LRUCache:
+    """A small thread-safe mapping that evicts its least recently used entries."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+class _TagBatch:
+    def __init__(self):
+        self.futures: Dict[str, Future] = {}
+        self.full = threading.Event()
+
+
+class _CoalescedTagChecker:
+    """Answer concurrent "already responded" checks with a single Tag.query.
+
+    The first caller of a batch waits up to `window_seconds` (or until `max_batch`
+    names are pending) and then looks all of them up at once for its callers.
+    """
+
+    def __init__(self, window_seconds: float = 0.01, max_batch: int = 20):
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+        self._open: Dict[str, _TagBatch] = {}
+        self._lock = threading.Lock()
+
+    def exists(self, client: Steamship, name: str) -> bool:
+        workspace = client.config.workspace_handle
+        with self._lock:
+            batch = self._open.get(workspace)
+            leader = batch is None
+            if leader:
+                batch = self._open[workspace] = _TagBatch()
+            future = batch.futures.setdefault(name, Future())
+            if len(batch.futures) >= self.max_batch:
+                # Later callers start a new batch
+                del self._open[workspace]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window_seconds)
+            with self._lock:
+                if self._open.get(workspace) is batch:
+                    del self._open[workspace]
+            self._resolve(client, batch)
+        return future.result()
+
+    @staticmethod
+    def _resolve(client: Steamship, batch: _TagBatch) -> None:
+        error = None
+        try:
+            names = " or ".join(f'name "{name}"' for name in batch.futures)
+            tags = Tag.query(
+                client, tag_filter_query=f'kind "chat_message_id" and ({names})'
             ).tags
-        )
-        > 0
-    )
+            found = {tag.name for tag in tags}
+            for name, future in batch.futures.items():
+                future.set_result(name in found)
+        except Exception as e:
+            error = e
+        finally:
+            # Never leave a waiting caller blocked
+            for future in batch.futures.values():
+                if not future.done():
+                    future.set_exception(
+                        error or RuntimeError("Tag lookup was not resolved")
+                    )
+
+
+_tag_checker = _CoalescedTagChecker()
+
+# Telegram retries an update within seconds, so most duplicates hit this process-local
+# cache and skip the Tag.query round trip.
+_seen_messages = _LRUCache(maxsize=10_000)
+
+# Durable records are only needed for later retries, so they are written off the
+# webhook's critical path.
+_recorder = ThreadPoolExecutor(max_workers=4)
+
+# There is one File per chat for the lifetime of the workspace
+_chat_file_ids = _LRUCache(maxsize=4096)
+
+
+def _message_key(client: Steamship, chat_id: int, message_id: str):
+    # A private chat's id is the user's id for every bot, so scope by workspace
+    return client.config.workspace_handle, chat_id, message_id
+
+
+def already_responded(client: Steamship, chat_id: str, message_id: str) -> bool:
+    if _seen_messages.get(_message_key(client, chat_id, message_id)):
+        return True
+    responded = _tag_checker.exists(client, f"{chat_id}_{message_id}")
+    if responded:
+        _seen_messages.put(_message_key(client, chat_id, message_id), True)
+    return responded
 
 
 def get_file_for_chat(client: Steamship, chat_id: int) -> File:
@@ -22,8 +129,31 @@ def get_file_for_chat(client: Steamship, chat_id: int) -> File:
         return File.create(client, handle=file_handle, blocks=[])
 
 
+def _file_id_for_chat(client: Steamship, chat_id: int) -> str:
+    key = (client.config.workspace_handle, chat_id)
+    file_id = _chat_file_ids.get(key)
+    if file_id is None:
+        file_id = get_file_for_chat(client, chat_id).id
+        _chat_file_ids.put(key, file_id)
+    return file_id
+
+
+def _log_record_failure(future: Future) -> None:
+    if future.exception() is not None:
+        logging.error(f"Failed to record response: {future.exception()}")
+
+
 def record_response(client: Steamship, chat_id: int, message_id: str):
-    file = get_file_for_chat(client, chat_id)
+    _seen_messages.put(_message_key(client, chat_id, message_id), True)
+    _recorder.submit(_do_record, client, chat_id, message_id).add_done_callback(
+        _log_record_failure
+    )
+
+
+def _do_record(client: Steamship, chat_id: int, message_id: str):
     Tag.create(
-        client, file_id=file.id, kind="chat_message_id", name=f"{chat_id}_{message_id}"
+        client,
+        file_id=_file_id_for_chat(client, chat_id),
+        kind="chat_message_id",
+        name=f"{chat_id}_{message_id}",
     )